@@ -1,47 +1,77 @@
+import base64
 import datetime
-import json
+import hashlib
+import hmac
 import logging
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+import botocore.session
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
-def load_params(namespace: str, env: str, region_name: str = 'us-east-1') -> dict:
-    """
-    Load parameters from SSM Parameter Store.
-    Function from https://www.davehall.com.au/blog/dave/2018/08/26/aws-parameter-store
+# SSM parameters change rarely, so warm containers reuse them for this many seconds.
+SSM_PARAMS_MAX_AGE = 300
 
-    :namespace: The application namespace.
-    :env: The current application environment.
-    :return: The config loaded from Parameter Store.
-    """
-    config = {}
-    path = f'/{namespace}/{env}/'
-    ssm = boto3.client('ssm', region_name=region_name)
-    more = None
-    args = {'Path': path, 'Recursive': True, 'WithDecryption': True}
-    while more is not False:
-        if more:
-            args['NextToken'] = more
-        params = ssm.get_parameters_by_path(**args)
-        for param in params['Parameters']:
-            key = param['Name'].split('/')[3]
-            config[key] = param['Value']
-        more = params.get('NextToken', False)
-    return config
+# Webhook events that update the pull request state store, as (event, action).
+WEBHOOK_EVENTS = {
+    ('pull_request', 'opened'),
+    ('pull_request', 'reopened'),
+    ('pull_request', 'synchronize'),
+    ('pull_request', 'closed'),
+    ('pull_request_review', 'submitted'),
+    ('pull_request_review', 'dismissed'),
+    ('pull_request_review_comment', 'created'),
+}
 
+# Age in days of a pull request from which it is flagged with a warning, then a fire.
+PR_WARNING_DAYS = 4
+PR_FIRE_DAYS = 6
 
-def check_open_pull_requests(event: dict, context) -> dict:
-    """
-    Checks pending pull requests and sends a notification
+# DynamoDB accepts at most this many writes per batch, and attempts made to get unprocessed writes through.
+DYNAMODB_BATCH_SIZE = 25
+DYNAMODB_ATTEMPTS = 5
 
-    """
-    # GraphQL query to get open pulls within an organization.
-    # For now only parsing top 100 pulls, and most recent reviews.
+# Slack message entry for a pull request, the optional lines are rendered empty or with their own newline.
+_PR_TEMPLATE = (" Repository: {repo}. Pull: {title}.\n URL: {url}.\n{changes_requested}"
+                " Author: {author}. Created: {created}\n{reviewers}{activity}")
+_CHANGES_REQUESTED_LINE = " :changes_requested: Changes requested, completion may take some time.\n"
+
+ACTION_LABELS = {
+    'APPROVED': 'approval',
+    'COMMENTED': 'comment',
+    'DISMISSED': 'dismissed approval'
+}
+
+# (connect, read) timeouts in seconds, github's GraphQL API has a long latency tail under load.
+GITHUB_TIMEOUT = (5, 120)
+SLACK_TIMEOUT = (5, 30)
+GITHUB_PREWARM_TIMEOUT = (5, 5)
+
+# Attempts made for a GraphQL query when github answers with a gateway error or a rate limit.
+GITHUB_ATTEMPTS = 3
 
-    query = '''
-{
-  search(query: "org:github_organization is:pr state:open", type: ISSUE, first: 100) {
+# Minimum seconds between two github calls.
+GITHUB_MIN_INTERVAL = 0.2
+
+# Seconds all github calls of an invocation may take, waits, retries and timeouts included.
+# Keep it below the Lambda timeout so a slow or rate limited github is given up rather than killing the handler.
+GITHUB_TIME_BUDGET = 240
+
+# GraphQL query to get open pulls matching the $q search, one page at a time.
+# For now only parsing the most recent reviews.
+_OPEN_PRS_QUERY = '''
+query ($q: String!, $cursor: String) {
+  search(query: $q, type: ISSUE, first: 50, after: $cursor) {
+    pageInfo {
+      endCursor
+      hasNextPage
+    }
     edges {
       node {
         ... on PullRequest {
@@ -54,37 +84,14 @@ def check_open_pull_requests(event: dict, context) -> dict:
           repository {
             name
           }
-          assignees(first: 10) {
-            totalCount
-            edges {
-              node {
-                login
-              }
-            }
-          }
-          reviewRequests(first: 20) {
+          reviewRequests {
             totalCount
-            edges {
-              node {
-                requestedReviewer {
-                  __typename
-                  ... on User {
-                    login
-                  }
-                  ... on Team {
-                    name
-                  }
-                }
-              }
-            }
           }
           reviews(first: 20) {
             totalCount
             edges {
               node {
-                author {
-                  login
-                }
+                id
                 state
               }
             }
@@ -95,106 +102,525 @@ def check_open_pull_requests(event: dict, context) -> dict:
   }
 }
 '''
-    # load configuration from the parameter store
-    ssm_parameters = load_params('dev_tools', 'dev')
-    skip_repositories = ssm_parameters['pr_skip_repositories'] if 'pr_skip_repositories' in ssm_parameters else ()
 
-    # get pulls from github
-    headers = {"Authorization": f"token {ssm_parameters['github_access_token']}"}
-    result = requests.post('https://api.github.com/graphql',
-                           json={'query': query.replace('github_organization', ssm_parameters['github_organization'])},
-                           headers=headers)
-
-    if result.status_code != 200:
-        logging.error(f"Github's API returned code {result.status_code} for query: {query}")
-        return
-
-    data = result.json()
-    if not data or not data.get('data'):
-        logging.error(f"Github's API returned invalid data: {data}")
-        return {}
-
-    action_labels = {
-        'APPROVED': 'approval',
-        'COMMENTED': 'comment',
-        'DISMISSED': 'dismissed approval'
-    }
-    # parse results and create slack message for notification
-    message = ''
-    for pr_node in data['data']['search']['edges']:
-
-        pr = pr_node['node']
-        repository_name = pr['repository']['name']
-
-        if repository_name in skip_repositories:
-            continue
-
-        # figure out the time that has passed since the pull request was created
-        now = datetime.datetime.utcnow()
-        created = datetime.datetime.strptime(pr['createdAt'], '%Y-%m-%dT%H:%M:%SZ')
-        time_diff = (now - created)
-
-        if time_diff.days:
-            time_since_created = f"{time_diff.days} day{'' if time_diff.days == 1 else 's'} ago"
-            # add warnings for old pull requests
-            if 3 < time_diff.days < 6:
-                time_since_created += ' :warning:'
-            elif time_diff.days >= 6:
-                time_since_created += ' :fire:'
+# A single session keeps the connections to github and slack alive across invocations.
+# Its retries only cover failed connections, POST requests are not retried on their response status.
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=10,
+                                       max_retries=Retry(total=3, backoff_factor=0.2,
+                                                         status_forcelist=(502, 503, 504))))
+# requests already asks for gzip/deflate compressed responses by default, which covers the GraphQL payload
+
+# AWS clients and loaded parameters are kept at module level to survive across invocations.
+# Clients come straight from botocore, which avoids importing boto3 on cold start.
+_botocore_session = botocore.session.get_session()
+_aws_clients = {}
+_ssm_params_cache = {}
+
+# Monotonic time before which github must not be called again, as asked by its rate limit headers.
+_github_next_call = 0.0
+
+# Background worker overlapping the github connection setup with other I/O.
+_executor = ThreadPoolExecutor(max_workers=1)
+
+# Whether this container already started opening its github connection.
+_github_prewarmed = False
+
+
+def _get_aws_client(service_name: str, region_name: str = 'us-east-1'):
+    """
+    Return the AWS client for the service and region, creating it on first use so its connection pool is reused.
+    """
+    if (service_name, region_name) not in _aws_clients:
+        _aws_clients[(service_name, region_name)] = _botocore_session.create_client(service_name,
+                                                                                    region_name=region_name)
+    return _aws_clients[(service_name, region_name)]
+
+
+# every invocation loads its configuration from SSM, so create that client during the Lambda init phase
+_get_aws_client('ssm')
+
+
+def load_params(namespace: str, env: str, region_name: str = 'us-east-1', max_age: int = SSM_PARAMS_MAX_AGE) -> dict:
+    """
+    Load parameters from SSM Parameter Store.
+    Function from https://www.davehall.com.au/blog/dave/2018/08/26/aws-parameter-store
+    Results are cached for max_age seconds.
+
+    :namespace: The application namespace.
+    :env: The current application environment.
+    :max_age: Seconds a previously loaded config is reused before Parameter Store is queried again.
+    :return: The config loaded from Parameter Store.
+    """
+    cache_key = (namespace, env, region_name)
+    cached = _ssm_params_cache.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    config = {}
+    path = f'/{namespace}/{env}/'
+    ssm = _get_aws_client('ssm', region_name)
+    more = None
+    args = {'Path': path, 'Recursive': True, 'WithDecryption': True}
+    while more is not False:
+        if more:
+            args['NextToken'] = more
+        params = ssm.get_parameters_by_path(**args)
+        for param in params['Parameters']:
+            key = param['Name'].split('/')[3]
+            config[key] = param['Value']
+        more = params.get('NextToken', False)
+
+    _ssm_params_cache[cache_key] = (time.monotonic() + max_age, config)
+    return config
+
+
+def _format_time_since(created_str: str, now: datetime.datetime, warn_days: int, fire_days: int) -> str:
+    """
+    Describe the time passed since a github timestamp, flagging old pull requests.
+
+    :created_str: The creation time as returned by github, e.g. 2019-01-31T10:00:00Z.
+    :now: The current time in UTC.
+    :warn_days: Age in days from which a warning is added.
+    :fire_days: Age in days from which the warning becomes a fire.
+    :return: The elapsed time, e.g. "5 days ago :warning:".
+    """
+    created = datetime.datetime.fromisoformat(created_str.replace('Z', '+00:00'))
+    time_diff = (now - created)
+
+    if time_diff.days:
+        time_since_created = f"{time_diff.days} day{'' if time_diff.days == 1 else 's'} ago"
+        # add warnings for old pull requests
+        if warn_days <= time_diff.days < fire_days:
+            time_since_created += ' :warning:'
+        elif time_diff.days >= fire_days:
+            time_since_created += ' :fire:'
+    else:
+        due_hours = int(time_diff.seconds / 3600)
+        if due_hours:
+            time_since_created = f"{due_hours} hour{'' if due_hours == 1 else 's'} ago"
+        else:
+            minutes_ago = int(time_diff.seconds / 60)
+            time_since_created = f"{minutes_ago} minute{'' if minutes_ago == 1 else 's'} ago"
+
+    return time_since_created
+
+
+def _skip_repositories(ssm_parameters: dict) -> frozenset:
+    """
+    Names of the repositories to leave out, from the comma separated pr_skip_repositories parameter.
+    """
+    names = (ssm_parameters.get('pr_skip_repositories') or '').split(',')
+    return frozenset(name.strip() for name in names if name.strip())
+
+
+def build_slack_message(pr: dict, now: datetime.datetime = None) -> str:
+    """
+    Build the slack message entry for a single pull request.
+
+    :pr: The pull request, shaped as returned by the GraphQL query.
+    :now: The current time in UTC, shared by all entries of a report. Defaults to the current time.
+    :return: The message lines describing the pull request.
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+    # collect activity
+    activity = Counter(review_node['node']['state'] for review_node in pr['reviews']['edges'])
+    activity_msg = ", ".join(f"{activity[action]} {ACTION_LABELS[action]}{'' if activity[action] == 1 else 's'}"
+                             for action in ('APPROVED', 'COMMENTED', 'DISMISSED') if activity[action])
+
+    pending_reviewers = pr['reviewRequests']['totalCount']
+
+    return _PR_TEMPLATE.format_map({
+        'repo': pr['repository']['name'],
+        'title': pr['title'],
+        'url': pr['url'],
+        'changes_requested': _CHANGES_REQUESTED_LINE if activity['CHANGES_REQUESTED'] else '',
+        'author': pr['author']['login'],
+        'created': _format_time_since(pr['createdAt'], now, PR_WARNING_DAYS, PR_FIRE_DAYS),
+        'reviewers': f" Reviewers: {pending_reviewers} pending.\n" if pending_reviewers else " No pending reviewers.\n",
+        'activity': f" Activity: {activity_msg}.\n" if activity_msg else '',
+    })
+
+
+def _post_slack(ssm_parameters: dict, text: str):
+    """
+    Send a notification to the configured slack webhook.
+    """
+    slack_headers = {'Content-type': 'application/json',
+                     'Authorization': f"Bearer {ssm_parameters['slack_access_token']}"}
+
+    r = _session.post(url=ssm_parameters['slack_webhook_url'],
+                      headers=slack_headers,
+                      data=orjson.dumps({'text': text}),
+                      timeout=SLACK_TIMEOUT)
+
+    if r.status_code != 200:
+        logging.error(f'Got status {r.status_code} while trying to post to the slack webhook url.')
+
+
+def _rate_limit_wait(result: requests.Response) -> float:
+    """
+    Seconds github asks to wait before the next call, from the response's rate limit headers.
+    """
+    try:
+        if result.headers.get('Retry-After'):
+            return float(result.headers['Retry-After'])
+        if result.headers.get('X-RateLimit-Remaining') == '0':
+            return float(result.headers.get('X-RateLimit-Reset', 0)) - time.time()
+    except ValueError:
+        logging.warning(f"Github's API returned unreadable rate limit headers: {dict(result.headers)}")
+    return 0.0
+
+
+def _schedule_next_github_call(result: requests.Response) -> float:
+    """
+    Delay the next github call by the minimum interval, or as long as the response's rate limit headers ask.
+
+    :return: The seconds github asked to wait before calling it again.
+    """
+    global _github_next_call
+    wait = max(GITHUB_MIN_INTERVAL, _rate_limit_wait(result))
+    _github_next_call = time.monotonic() + wait
+    return wait
+
+
+def _prewarm_github():
+    """
+    Open the pooled connection to github ahead of the first query, failures are left for the query to handle.
+    The rate limit endpoint is used as it does not count against github's rate limits.
+    """
+    try:
+        _session.head('https://api.github.com/rate_limit', timeout=GITHUB_PREWARM_TIMEOUT)
+    except requests.RequestException:
+        pass
+
+
+def _start_github_prewarm():
+    """
+    Start opening the github connection in the background, once per container.
+    Nothing waits for it, a query sent before it finished opens its own connection.
+    """
+    global _github_prewarmed
+    if not _github_prewarmed:
+        _github_prewarmed = True
+        _executor.submit(_prewarm_github)
+
+
+def _post_github(headers: dict, payload: dict, deadline: float) -> requests.Response or None:
+    """
+    Post a query to github's GraphQL API, retrying the 502/504 gateway errors it returns under load.
+    The connection that returned a gateway error is closed, so the retry opens a fresh one instead of
+    reusing a pooled connection to a bad upstream.
+    Calls are spaced by GITHUB_MIN_INTERVAL, and rate limited queries are retried once the limit allows it.
+    Nothing waits or reads past the deadline, a call that cannot be made before it is given up.
+
+    :deadline: Monotonic time by which github has to have answered.
+    :return: The last response, or None when github could not be called before the deadline.
+    """
+    headers = {**headers, 'Content-Type': 'application/json'}
+    body = orjson.dumps(payload)
+    result = None
+    for attempt in range(GITHUB_ATTEMPTS):
+        wait = _github_next_call - time.monotonic()
+        if result is not None and result.status_code in (502, 504):
+            wait = max(wait, 0.2 * 2 ** attempt)
+
+        if time.monotonic() + wait >= deadline:
+            logging.error(f"Github can't be called for another {wait:.0f} seconds, past the deadline, "
+                          f"giving up on the query.")
+            return result
+
+        if result is not None:
+            logging.warning(f"Github's API returned code {result.status_code}, retrying.")
+        if wait > 0:
+            time.sleep(wait)
+
+        remaining = deadline - time.monotonic()
+        result = _session.post('https://api.github.com/graphql', data=body, headers=headers,
+                               timeout=(min(GITHUB_TIMEOUT[0], remaining), min(GITHUB_TIMEOUT[1], remaining)),
+                               stream=True)
+        if result.status_code in (502, 504):
+            # closing the unread response closes its connection before it goes back to the pool
+            result.close()
         else:
-            due_hours = int(time_diff.seconds / 3600)
-            if due_hours:
-                time_since_created = f"{due_hours} hour{'' if due_hours == 1 else 's'} ago"
-            else:
-                minutes_ago = int(time_diff.seconds / 60)
-                time_since_created = f"{minutes_ago} minute{'' if minutes_ago == 1 else 's'} ago"
-
-        # pull request summary for the message
-        message += f" Repository: {repository_name}."
-        message += f" Pull: {pr['title']}.\n"
-        message += f" URL: {pr['url']}.\n"
-
-        # collect activity
-        activity = {'APPROVED': 0,
-                    'CHANGES_REQUESTED': 0,
-                    'COMMENTED': 0,
-                    'DISMISSED': 0,
-                    'PENDING': 0}
-
-        if pr['reviews']['totalCount'] > 0:
-            for review_node in pr['reviews']['edges']:
-                activity[review_node['node']['state']] += 1
-
-            if activity['CHANGES_REQUESTED']:
-                message += f" :changes_requested: Changes requested, completion may take some time.\n"
-
-        message += f" Author: {pr['author']['login']}. Created: {time_since_created}\n"
-
-        if pr['reviewRequests']['totalCount']:
-            message += f" Reviewers: {pr['reviewRequests']['totalCount']} pending.\n"
+            # reading the body hands the connection back to the pool for the next query
+            result.content
+        wait = _schedule_next_github_call(result)
+
+        rate_limited = result.status_code in (403, 429) and wait > GITHUB_MIN_INTERVAL
+        if result.status_code not in (502, 504) and not rate_limited:
+            break
+    return result
+
+
+def _pr_state_item(pr: dict) -> dict:
+    """
+    State store item for a pull request, shaped as returned by the GraphQL query, keyed by its url.
+    """
+    return {'pr_url': {'S': pr['url']},
+            'pr': {'S': orjson.dumps(pr).decode()},
+            'revision': {'S': uuid.uuid4().hex},
+            'updated_at': {'N': repr(time.time())}}
+
+
+def _write_pr_states(table_name: str, prs: list = (), removed_urls: list = ()) -> bool:
+    """
+    Store and remove pull requests in batches, resubmitting whatever DynamoDB leaves unprocessed.
+
+    :return: Whether every write went through.
+    """
+    written = True
+    write_requests = [{'PutRequest': {'Item': _pr_state_item(pr)}} for pr in prs]
+    write_requests += [{'DeleteRequest': {'Key': {'pr_url': {'S': pr_url}}}} for pr_url in removed_urls]
+
+    dynamodb = _get_aws_client('dynamodb')
+    for start in range(0, len(write_requests), DYNAMODB_BATCH_SIZE):
+        pending = {table_name: write_requests[start:start + DYNAMODB_BATCH_SIZE]}
+        for attempt in range(DYNAMODB_ATTEMPTS):
+            if attempt:
+                time.sleep(0.1 * 2 ** attempt)
+            pending = dynamodb.batch_write_item(RequestItems=pending).get('UnprocessedItems')
+            if not pending:
+                break
         else:
-            message += " No pending reviewers.\n"
+            logging.error(f'DynamoDB left {len(pending[table_name])} pull request writes unprocessed.')
+            written = False
+    return written
 
-        activity_msg = ''
-        for action in ('APPROVED', 'COMMENTED', 'DISMISSED'):
-            if activity[action]:
-                if activity_msg:
-                    activity_msg += ", "
-                activity_msg += f"{activity[action]} {action_labels[action]}{'' if activity[action] == 1 else 's'}"
 
-        if activity_msg:
-            message += f" Activity: {activity_msg}.\n"
+def _scan_pr_states(table_name: str, projection: str):
+    """
+    Iterate over the items of the state store, reading only the projected attributes.
+    """
+    pages = _get_aws_client('dynamodb').get_paginator('scan').paginate(TableName=table_name,
+                                                                       ProjectionExpression=projection)
+    for page in pages:
+        yield from page['Items']
 
-    if message:
-        # send notification via slack
-        slack_headers = {'Content-type': 'application/json',
-                         'Authorization': f"Bearer {ssm_parameters['slack_access_token']}"}
 
-        r = requests.post(url=ssm_parameters['slack_webhook_url'],
-                          headers=slack_headers,
-                          data=json.dumps({'text': f'The following pull requests are OPEN:\n\n{message}\n'}))
+def _stale_pr_urls(table_name: str, updated_before: float) -> list:
+    """
+    Urls of the stored pull requests that were last written before the given time.
+    """
+    return [item['pr_url']['S'] for item in _scan_pr_states(table_name, 'pr_url, updated_at')
+            if float(item.get('updated_at', {'N': '0'})['N']) < updated_before]
+
+
+def _stored_pull_requests(table_name: str) -> list:
+    """
+    The open pull requests kept in the state store, newest first.
+    """
+    prs = [orjson.loads(item['pr']['S']) for item in _scan_pr_states(table_name, 'pr')]
+    return sorted(prs, key=lambda pr: pr['createdAt'], reverse=True)
+
 
-        if r.status_code != 200:
-            logging.error(f'Got status {r.status_code} while trying to post to the slack webhook url.')
+def _store_webhook_pr(table_name: str, pull_request: dict, review: dict = None) -> tuple:
+    """
+    Merge a webhook's pull request, and the review it submitted or dismissed if any, into the state store.
+    Writes are conditional on the revision that was read, so concurrent deliveries retry instead of
+    overwriting each other. Reviews are keyed by their GraphQL node id, the one reconciliation stores too,
+    so redelivered and dismissed reviews update their entry instead of adding another.
+
+    :return: The stored pull request, and whether this call added it to the store.
+    """
+    dynamodb = _get_aws_client('dynamodb')
+    key = {'pr_url': {'S': pull_request['html_url']}}
+    for attempt in range(DYNAMODB_ATTEMPTS):
+        item = dynamodb.get_item(TableName=table_name, Key=key, ConsistentRead=True).get('Item')
+
+        review_edges = orjson.loads(item['pr']['S'])['reviews']['edges'] if item else []
+        if review:
+            review_edges = [edge for edge in review_edges if edge['node'].get('id') != review['node_id']]
+            review_edges.append({'node': {'id': review['node_id'], 'state': review['state'].upper()}})
+        pr = _pull_request_from_webhook(pull_request, review_edges)
+
+        if item:
+            condition = {'ConditionExpression': 'revision = :revision',
+                         'ExpressionAttributeValues': {':revision': item['revision']}}
+        else:
+            condition = {'ConditionExpression': 'attribute_not_exists(pr_url)'}
+        try:
+            dynamodb.put_item(TableName=table_name, Item=_pr_state_item(pr), **condition)
+            return pr, item is None
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            if attempt == DYNAMODB_ATTEMPTS - 1:
+                raise
+            logging.warning(f"Pull request {pull_request['html_url']} changed while updating it, retrying.")
+
+
+def _pull_request_from_webhook(pull_request: dict, review_edges: list) -> dict:
+    """
+    Map a webhook pull_request payload onto the fields read from the GraphQL query.
+    """
+    requested = len(pull_request.get('requested_reviewers') or []) + len(pull_request.get('requested_teams') or [])
+    return {
+        'url': pull_request['html_url'],
+        'title': pull_request['title'],
+        'createdAt': pull_request['created_at'],
+        'author': {'login': pull_request['user']['login']},
+        'repository': {'name': pull_request['base']['repo']['name']},
+        'reviewRequests': {'totalCount': requested},
+        'reviews': {'totalCount': len(review_edges), 'edges': review_edges},
+    }
+
+
+def _verify_github_signature(secret: str, body: bytes, signature: str) -> bool:
+    """
+    Check the X-Hub-Signature-256 header sent by github against the webhook secret.
+    """
+    expected = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or '')
+
+
+def handle_github_webhook(event: dict, context) -> dict:
+    """
+    Receives github pull request webhooks through API Gateway, updates the
+    pull request state store and notifies new pull requests.
+
+    """
+    ssm_parameters = load_params('dev_tools', 'dev')
+
+    body = event.get('body') or ''
+    body = base64.b64decode(body) if event.get('isBase64Encoded') else body.encode()
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+
+    if not _verify_github_signature(ssm_parameters['github_webhook_secret'], body,
+                                    headers.get('x-hub-signature-256')):
+        logging.error('Rejected a github webhook with an invalid signature.')
+        return {'statusCode': 401, 'body': 'Invalid signature.'}
+
+    payload = orjson.loads(body)
+    github_event = headers.get('x-github-event')
+    action = payload.get('action')
+    if (github_event, action) not in WEBHOOK_EVENTS:
+        return {'statusCode': 202, 'body': f'Ignored {github_event}.{action}.'}
+
+    skip_repositories = _skip_repositories(ssm_parameters)
+    pull_request = payload['pull_request']
+    if pull_request['base']['repo']['name'] in skip_repositories:
+        return {'statusCode': 202, 'body': 'Ignored skipped repository.'}
+
+    table_name = ssm_parameters['pr_state_table']
+    pr_url = pull_request['html_url']
+
+    # closed pull requests leave the store, later events on them must not bring them back
+    if pull_request['state'] == 'closed':
+        _get_aws_client('dynamodb').delete_item(TableName=table_name, Key={'pr_url': {'S': pr_url}})
+        return {'statusCode': 200, 'body': 'Removed.'}
+
+    pr, created = _store_webhook_pr(table_name, pull_request, payload.get('review'))
+
+    # only the delivery that added the pull request notifies it, redeliveries find it stored already
+    if created and github_event == 'pull_request' and action in ('opened', 'reopened'):
+        _post_slack(ssm_parameters, f'The following pull request is OPEN:\n\n{build_slack_message(pr)}\n')
+
+    return {'statusCode': 200, 'body': 'Updated.'}
+
+
+def _fetch_open_pull_requests(ssm_parameters: dict) -> list:
+    """
+    Search github for the open pull requests of the organization, leaving out the skipped repositories.
+
+    :return: The pull requests, shaped as returned by the GraphQL query, or None when github failed.
+    """
+    skip_repositories = _skip_repositories(ssm_parameters)
+    headers = {"Authorization": f"token {ssm_parameters['github_access_token']}"}
+    search_query = f"org:{ssm_parameters['github_organization']} is:pr state:open"
+
+    prs = []
+    github_deadline = time.monotonic() + GITHUB_TIME_BUDGET
+    cursor = None
+    has_next_page = True
+    while has_next_page:
+        # get the next page of pulls from github
+        result = _post_github(headers, {'query': _OPEN_PRS_QUERY,
+                                        'variables': {'q': search_query, 'cursor': cursor}},
+                              github_deadline)
+
+        if result is None:
+            return None
+        if result.status_code != 200:
+            logging.error(f"Github's API returned code {result.status_code} for query: {search_query}")
+            return None
+
+        # drop the response as soon as it is parsed so its raw body is not kept alive during the loop
+        data = orjson.loads(result.content)
+        del result
+        if not data or not data.get('data'):
+            logging.error(f"Github's API returned invalid data: {data}")
+            return None
+
+        search = data['data']['search']
+        for pr_node in search['edges']:
+
+            # skipped repositories are dropped before any other per pull request work
+            pr = pr_node['node']
+            if pr['repository']['name'] in skip_repositories:
+                continue
+
+            prs.append(pr)
+
+        has_next_page = search['pageInfo']['hasNextPage']
+        cursor = search['pageInfo']['endCursor']
+
+    return prs
+
+
+def reconcile_pull_requests(event: dict, context) -> int:
+    """
+    Brings the state store in line with github, catching up on any webhook deliveries that were missed:
+    every open pull request is rewritten, and the ones left untouched since the sync started were closed.
+    Meant to run on a slow schedule, webhooks keep the store current in between.
+
+    """
+    # on a new container, open the github connection while the configuration loads
+    _start_github_prewarm()
+
+    # load configuration from the parameter store
+    ssm_parameters = load_params('dev_tools', 'dev')
+    table_name = ssm_parameters['pr_state_table']
+
+    sync_started = time.time()
+    prs = _fetch_open_pull_requests(ssm_parameters)
+    if prs is None:
+        return None
+
+    # pull requests whose write failed look stale too, so only sweep after a complete pass
+    if _write_pr_states(table_name, prs):
+        _write_pr_states(table_name, removed_urls=_stale_pr_urls(table_name, sync_started))
+
+    return len(prs)
+
+
+def check_open_pull_requests(event: dict, context) -> dict:
+    """
+    Checks pending pull requests and sends a notification.
+    The pull requests are read from the state store when one is configured, otherwise github is searched.
+
+    """
+    # on a new container, open the github connection in case the configuration has no state store
+    _start_github_prewarm()
+
+    # load configuration from the parameter store
+    ssm_parameters = load_params('dev_tools', 'dev')
+    table_name = ssm_parameters.get('pr_state_table')
+
+    if table_name:
+        skip_repositories = _skip_repositories(ssm_parameters)
+        prs = [pr for pr in _stored_pull_requests(table_name) if pr['repository']['name'] not in skip_repositories]
+    else:
+        prs = _fetch_open_pull_requests(ssm_parameters)
+        if prs is None:
+            return None
+
+    # create slack message for notification
+    now = datetime.datetime.now(datetime.timezone.utc)
+    message = "".join(build_slack_message(pr, now) for pr in prs)
+
+    if message:
+        # send notification via slack
+        _post_slack(ssm_parameters, f'The following pull requests are OPEN:\n\n{message}\n')
 
     return message
@@ -0,0 +1,225 @@
+import hashlib
+import hmac
+import time
+
+import orjson
+import pytest
+
+import handler
+
+TABLE = 'pull-requests'
+SECRET = 'webhook-secret'
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeDynamoDB:
+    """
+    In-memory stand-in for the DynamoDB client calls made by the handler.
+    """
+    class exceptions:
+        ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    def __init__(self):
+        self.items = {}
+        self.before_get = None
+        self.unprocessed_batches = 0
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        item = self.items.get(Key['pr_url']['S'])
+        if self.before_get:
+            before_get, self.before_get = self.before_get, None
+            before_get()
+        return {'Item': item} if item else {}
+
+    def put_item(self, TableName, Item, ConditionExpression, ExpressionAttributeValues=None):
+        current = self.items.get(Item['pr_url']['S'])
+        if ConditionExpression == 'attribute_not_exists(pr_url)':
+            if current:
+                raise ConditionalCheckFailedException()
+        elif not current or current['revision'] != ExpressionAttributeValues[':revision']:
+            raise ConditionalCheckFailedException()
+        self.items[Item['pr_url']['S']] = Item
+
+    def delete_item(self, TableName, Key):
+        self.items.pop(Key['pr_url']['S'], None)
+
+    def batch_write_item(self, RequestItems):
+        (table_name, write_requests), = RequestItems.items()
+        assert len(write_requests) <= handler.DYNAMODB_BATCH_SIZE
+        if self.unprocessed_batches:
+            self.unprocessed_batches -= 1
+            return {'UnprocessedItems': RequestItems}
+        for write_request in write_requests:
+            if 'PutRequest' in write_request:
+                item = write_request['PutRequest']['Item']
+                self.items[item['pr_url']['S']] = item
+            else:
+                self.items.pop(write_request['DeleteRequest']['Key']['pr_url']['S'], None)
+        return {}
+
+    def get_paginator(self, operation_name):
+        items = list(self.items.values())
+
+        class Paginator:
+            def paginate(self, TableName, ProjectionExpression):
+                return [{'Items': items}]
+
+        return Paginator()
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    fake = FakeDynamoDB()
+    monkeypatch.setitem(handler._aws_clients, ('dynamodb', 'us-east-1'), fake)
+    monkeypatch.setattr(handler, 'load_params', lambda *args, **kwargs: {
+        'github_webhook_secret': SECRET,
+        'pr_state_table': TABLE,
+        'pr_skip_repositories': 'skipped',
+    })
+    monkeypatch.setattr(handler, '_start_github_prewarm', lambda: None)
+    monkeypatch.setattr(handler.time, 'sleep', lambda seconds: None)
+    return fake
+
+
+@pytest.fixture
+def slack(monkeypatch):
+    messages = []
+    monkeypatch.setattr(handler, '_post_slack', lambda ssm_parameters, text: messages.append(text))
+    return messages
+
+
+def _pull_request(number=1, state='open', repository='api'):
+    return {
+        'html_url': f'https://github.com/org/{repository}/pull/{number}',
+        'state': state,
+        'title': f'Pull {number}',
+        'created_at': '2026-10-10T10:00:00Z',
+        'user': {'login': 'author'},
+        'base': {'repo': {'name': repository}},
+        'requested_reviewers': [],
+        'requested_teams': [],
+    }
+
+
+def _graphql_pull_request(number=1, review_states=()):
+    return {
+        'url': f'https://github.com/org/api/pull/{number}',
+        'title': f'Pull {number}',
+        'createdAt': f'2026-10-10T{number % 24:02d}:00:00Z',
+        'author': {'login': 'author'},
+        'repository': {'name': 'api'},
+        'reviewRequests': {'totalCount': 0},
+        'reviews': {'totalCount': len(review_states),
+                    'edges': [{'node': {'id': f'PRR_{i}', 'state': state}} for i, state in enumerate(review_states)]},
+    }
+
+
+def _deliver(github_event, payload):
+    body = orjson.dumps(payload)
+    signature = 'sha256=' + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return handler.handle_github_webhook({'body': body.decode(),
+                                          'headers': {'X-GitHub-Event': github_event,
+                                                      'X-Hub-Signature-256': signature}}, None)
+
+
+def _review(node_id, state, pull_request=None, action='submitted'):
+    return {'action': action, 'pull_request': pull_request or _pull_request(),
+            'review': {'id': 1, 'node_id': node_id, 'state': state}}
+
+
+def _stored_review_states(dynamodb, pr_url=None):
+    pr = orjson.loads(dynamodb.items[pr_url or _pull_request()['html_url']]['pr']['S'])
+    return sorted(edge['node']['state'] for edge in pr['reviews']['edges'])
+
+
+def test_webhook_rejects_invalid_signature(dynamodb):
+    event = {'body': '{}', 'headers': {'X-GitHub-Event': 'pull_request', 'X-Hub-Signature-256': 'sha256=bad'}}
+    assert handler.handle_github_webhook(event, None)['statusCode'] == 401
+    assert not dynamodb.items
+
+
+def test_redelivered_opened_event_notifies_once(dynamodb, slack):
+    payload = {'action': 'opened', 'pull_request': _pull_request()}
+    assert _deliver('pull_request', payload)['statusCode'] == 200
+    assert _deliver('pull_request', payload)['statusCode'] == 200
+    assert len(slack) == 1
+    assert 'Pull: Pull 1.' in slack[0]
+
+
+def test_concurrent_reviews_are_both_kept(dynamodb, slack):
+    _deliver('pull_request', {'action': 'opened', 'pull_request': _pull_request()})
+    # another delivery writes between this one's read and its conditional write
+    dynamodb.before_get = lambda: _deliver('pull_request_review', _review('PRR_a', 'approved'))
+    _deliver('pull_request_review', _review('PRR_b', 'commented'))
+    assert _stored_review_states(dynamodb) == ['APPROVED', 'COMMENTED']
+
+
+def test_redelivered_review_after_reconciliation_is_counted_once(dynamodb, monkeypatch):
+    monkeypatch.setattr(handler, '_fetch_open_pull_requests',
+                        lambda ssm_parameters: [_graphql_pull_request(1, ['APPROVED'])])
+    handler.reconcile_pull_requests({}, None)
+    _deliver('pull_request_review', _review('PRR_0', 'approved'))
+    assert _stored_review_states(dynamodb) == ['APPROVED']
+
+
+def test_dismissed_review_replaces_approval(dynamodb):
+    _deliver('pull_request_review', _review('PRR_a', 'approved'))
+    _deliver('pull_request_review', _review('PRR_a', 'dismissed', action='dismissed'))
+    assert _stored_review_states(dynamodb) == ['DISMISSED']
+
+
+def test_events_on_closed_pull_request_do_not_store_it(dynamodb, slack):
+    _deliver('pull_request', {'action': 'opened', 'pull_request': _pull_request()})
+    closed = _pull_request(state='closed')
+    _deliver('pull_request', {'action': 'closed', 'pull_request': closed})
+    _deliver('pull_request_review', _review('PRR_a', 'approved', pull_request=closed))
+    assert not dynamodb.items
+
+
+def test_reconciliation_removes_pull_requests_closed_without_webhook(dynamodb, monkeypatch):
+    stale = handler._pr_state_item(_graphql_pull_request(2))
+    stale['updated_at'] = {'N': '1'}
+    dynamodb.items[stale['pr_url']['S']] = stale
+    monkeypatch.setattr(handler, '_fetch_open_pull_requests',
+                        lambda ssm_parameters: [_graphql_pull_request(i) for i in range(3, 33)])
+
+    assert handler.reconcile_pull_requests({}, None) == 30
+    assert stale['pr_url']['S'] not in dynamodb.items
+    assert len(dynamodb.items) == 30
+
+
+def test_reconciliation_keeps_items_when_a_write_fails(dynamodb, monkeypatch):
+    stale = handler._pr_state_item(_graphql_pull_request(2))
+    stale['updated_at'] = {'N': '1'}
+    dynamodb.items[stale['pr_url']['S']] = stale
+    dynamodb.unprocessed_batches = handler.DYNAMODB_ATTEMPTS
+    monkeypatch.setattr(handler, '_fetch_open_pull_requests', lambda ssm_parameters: [_graphql_pull_request(3)])
+
+    handler.reconcile_pull_requests({}, None)
+    assert stale['pr_url']['S'] in dynamodb.items
+
+
+def test_report_is_built_from_the_state_store(dynamodb, slack, monkeypatch):
+    def fail(ssm_parameters):
+        raise AssertionError('the report must not search github')
+    monkeypatch.setattr(handler, '_fetch_open_pull_requests', fail)
+    for pr in (_graphql_pull_request(1, ['APPROVED']), _graphql_pull_request(2)):
+        dynamodb.items[pr['url']] = handler._pr_state_item(pr)
+    skipped = _graphql_pull_request(3)
+    skipped['repository']['name'] = 'skipped'
+    dynamodb.items[skipped['url']] = handler._pr_state_item(skipped)
+
+    message = handler.check_open_pull_requests({}, None)
+    assert message.index('/pull/2.') < message.index('/pull/1.')
+    assert '/pull/3.' not in message
+    assert 'Activity: 1 approval.' in message
+    assert len(slack) == 1
+
+
+def test_github_wait_past_the_deadline_gives_up_without_calling(monkeypatch):
+    monkeypatch.setattr(handler, '_github_next_call', time.monotonic() + 3000)
+    monkeypatch.setattr(handler._session, 'post', lambda *args, **kwargs: pytest.fail('github was called'))
+    assert handler._post_github({}, {}, time.monotonic() + handler.GITHUB_TIME_BUDGET) is None